@@ -1,19 +1,55 @@
 # -*- coding: utf8 -*-
 import os
+import re
 import sys
 import locale
 import logging
+import logging.handlers
+import atexit
+import signal
 import subprocess
 import tempfile
 import sqlite3
 import zipfile
 import tarfile
+import threading
+import time
+import collections
+import fnmatch
+import struct
+import hashlib
+import stat
+import errno
+import binascii
+import posixpath
+import mmap
+import bisect
+import pickle
+import marshal
+import zlib
+import array
+import shlex
 
 try:
     import xml.etree.cElementTree as ElementTree
 except ImportError:
     import xml.etree.ElementTree as ElementTree
 
+try:
+    from urllib.parse import quote as _url_quote, unquote as _url_unquote
+except ImportError:
+    from urllib import quote as _url_quote, unquote as _url_unquote
+
+try:
+    import queue as _queue
+except ImportError:
+    import Queue as _queue
+
+try:
+    from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
+except ImportError:  # python 2 without the futures backport
+    _ThreadPoolExecutor = None
+
 
 # In python 3, os must be imported again at the end
 import os
@@ -24,17 +60,20 @@ else:
     _IS_OS_WIN32 = False
 
 
-__version__ = '0.1.27'
+__version__ = '0.1.39'
 
 
 __all__ = ['Error',
            'OsxError',
-           'OsxSystemExecError', 'OsxPathError', 'OsxPathNotExistError', 'OsxPathAlreadyExistError', 'OsxPathTypeUnsupportedError',
+           'OsxSystemExecError', 'OsxSystemExecInterruptedError', 'OsxSystemExecTimeoutError', 'OsxSystemExecCancelledError',
+           'OsxPathError', 'OsxPathNotExistError', 'OsxPathAlreadyExistError', 'OsxPathTypeUnsupportedError',
            'SvnError',
            'SvnNoMessageError', 'SvnAlreadyLockedError', 'SvnBranchDestinationAlreadyExistError',
            'GitError', 
            'GitParseMetaDataError',
+           'ZipError',
            'set_logger', 'set_local_encoding',
+           'ASYNC_LOG_OVERFLOW_DROP', 'ASYNC_LOG_OVERFLOW_DROP_OLDEST', 'ASYNC_LOG_OVERFLOW_BLOCK',
            'raw_input_nonblock',
            'Osx', 'osx',
            'Svn', 'svn',
@@ -46,10 +85,12 @@ __all__ = ['Error',
 if sys.version_info[0] == 3:
     _PY3 = True
     _unicode = str
+    _integer_types = (int,)
     _raw_input = input
 else:
     _PY3 = False
     _unicode = unicode
+    _integer_types = (int, long)
     _raw_input = raw_input
 
 
@@ -79,6 +120,24 @@ class OsxSystemExecError(OsxError):
         self.output = output
 
 
+class OsxSystemExecInterruptedError(OsxSystemExecError):
+    """
+    The command is killed with it's process tree before complete, code is None and output is the partial output.
+    """
+    pass
+
+
+class OsxSystemExecTimeoutError(OsxSystemExecInterruptedError):
+    def __init__(self, cmd, output, timeout):
+        OsxSystemExecInterruptedError.__init__(self, cmd, None, output, "command timed out after %s seconds: %s" % (timeout, cmd))
+        self.timeout = timeout
+
+
+class OsxSystemExecCancelledError(OsxSystemExecInterruptedError):
+    def __init__(self, cmd, output):
+        OsxSystemExecInterruptedError.__init__(self, cmd, None, output, "command cancelled: %s" % cmd)
+
+
 class OsxPathError(OsxError):
     def __init__(self, path):
         OsxError.__init__(self)
@@ -107,10 +166,10 @@ class OsxPathTypeUnsupportedError(OsxPathError):
         self.message = msg
 
     def __str__(self):
-        if self.msg is None:
+        if self.message is None:
             return "path '%s' is unsupported type" % self.path
         else:
-            return self.msg
+            return self.message
 
 
 class SvnError(Error):
@@ -147,10 +206,148 @@ class GitParseMetaDataError(GitError):
         SvnError.__init__(self, "git meta data error: %s" % msg)
 
 
+class ZipError(Error):
+    pass
+
+
+ASYNC_LOG_OVERFLOW_DROP = 'drop'  # drop the new record
+ASYNC_LOG_OVERFLOW_DROP_OLDEST = 'drop-oldest'
+ASYNC_LOG_OVERFLOW_BLOCK = 'block'
+
+
+if hasattr(logging.handlers, 'QueueHandler'):
+    class _OverflowQueueHandler(logging.handlers.QueueHandler):
+        def __init__(self, record_queue, overflow):
+            logging.handlers.QueueHandler.__init__(self, record_queue)
+            self.overflow = overflow
+            self.dropped_count = 0
+            self._dropped_count_lock = threading.Lock()
+
+        def _add_dropped_count(self, count):
+            with self._dropped_count_lock:
+                self.dropped_count += count
+
+        def enqueue(self, record):
+            if self.overflow == ASYNC_LOG_OVERFLOW_BLOCK:
+                self.queue.put(record)
+                return
+            try:
+                self.queue.put_nowait(record)
+                return
+            except _queue.Full:
+                pass
+            if self.overflow == ASYNC_LOG_OVERFLOW_DROP_OLDEST:
+                try:
+                    self.queue.get_nowait()
+                except _queue.Empty:
+                    pass
+                try:
+                    self.queue.put_nowait(record)
+                except _queue.Full:
+                    self._add_dropped_count(1)
+            self._add_dropped_count(1)
+
+
+class _BatchQueueListener:
+    """
+    Write records from queue to the handlers of logger in a background thread.
+    Each handler is locked once per batch instead of once per record.
+    """
+    _SENTINEL = None
+
+    def __init__(self, record_queue, logger, queue_handler, batch_size):
+        self.queue = record_queue
+        self.logger = logger
+        self.queue_handler = queue_handler
+        self.batch_size = batch_size
+        self._reported_dropped_count = 0
+        self._thread = threading.Thread(target=self._run, name='quickstartutil-log')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.queue.put(self._SENTINEL)
+        self._thread.join()
+
+    def _handlers(self):
+        handlers = []
+        logger = self.logger
+        while logger is not None:
+            handlers.extend(logger.handlers)
+            logger = logger.parent if logger.propagate else None
+        return handlers
+
+    def _write(self, records):
+        dropped_count = self.queue_handler.dropped_count
+        if dropped_count != self._reported_dropped_count:
+            records.append(self.logger.makeRecord(self.logger.name, logging.WARNING, __file__, 0,
+                                                  '%d log records dropped by overflow of queue',
+                                                  (dropped_count - self._reported_dropped_count,), None))
+            self._reported_dropped_count = dropped_count
+        records = [record for record in records if self.logger.filter(record)]
+        for handler in self._handlers():
+            handler.acquire()
+            try:
+                for record in records:
+                    if record.levelno >= handler.level and handler.filter(record):
+                        try:
+                            handler.emit(record)
+                        except Exception:
+                            handler.handleError(record)
+            finally:
+                handler.release()
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            records = [self.queue.get()]
+            while len(records) < self.batch_size:
+                try:
+                    records.append(self.queue.get_nowait())
+                except _queue.Empty:
+                    break
+            if self._SENTINEL in records:
+                stopped = True
+                records = [record for record in records if record is not self._SENTINEL]
+            self._write(records)
+
+
 _logger = logging.getLogger('quickstartutil')
-def set_logger(logger):
-    global _logger
-    _logger = logger
+_async_log_listener = None
+def _stop_async_logging():
+    global _async_log_listener
+    if _async_log_listener is not None:
+        _async_log_listener.stop()
+        _async_log_listener = None
+atexit.register(_stop_async_logging)
+
+
+def set_logger(logger, async_queue_size=None, overflow=ASYNC_LOG_OVERFLOW_DROP, batch_size=64):
+    """
+    :param async_queue_size: None to log synchronously,
+        otherwise records are put into a queue of this size and written to the handlers of logger by a background thread,
+        the level of logger is taken at this call
+    :param overflow: what to do when the queue is full, ASYNC_LOG_OVERFLOW_XXX
+    :param batch_size: max count of records written at once by the background thread
+    """
+    global _logger, _async_log_listener
+    _stop_async_logging()
+    if async_queue_size is None:
+        _logger = logger
+        return
+
+    if not hasattr(logging.handlers, 'QueueHandler'):
+        raise NotImplementedError('Asynchronous logging requires python 3.2+.')
+    record_queue = _queue.Queue(async_queue_size)
+    queue_handler = _OverflowQueueHandler(record_queue, overflow)
+    async_logger = logging.Logger(logger.name, logger.getEffectiveLevel())
+    async_logger.propagate = False
+    async_logger.addHandler(queue_handler)
+    _async_log_listener = _BatchQueueListener(record_queue, logger, queue_handler, batch_size)
+    _async_log_listener.start()
+    _logger = async_logger
 
 
 _default_local_encoding = locale.getdefaultlocale()[1]
@@ -179,6 +376,105 @@ def _to_local_str(s):
         return _to_unicode_str(s).encode(_local_encoding)
 
 
+_monotonic = getattr(time, 'monotonic', time.time)  # not affected by system clock adjustments
+
+
+def _int64_array():
+    """
+    compact sequence of 64 bits integers, a list on python 2 where the 'l' array is 32 bits on windows
+    """
+    try:
+        return array.array('q')
+    except ValueError:  # python 2
+        return []
+
+
+def _parallel_map(func, iterable, workers):
+    """
+    map func over iterable in a thread pool if possible, the results keep the order of iterable
+    """
+    if _ThreadPoolExecutor is None or workers is None or workers <= 1:
+        return list(map(func, iterable))
+    with _ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(func, iterable))
+
+
+def _stat_mtime_ns(st):
+    if hasattr(st, 'st_mtime_ns'):
+        return st.st_mtime_ns
+    return int(st.st_mtime * 1000000000)
+
+
+def _lstat_dir_entries(dir_path):
+    """
+    return dict of name -> lstat result of the entries in dir_path, empty if dir_path is not a directory
+    """
+    ret = {}
+    try:
+        if hasattr(os, 'scandir'):  # the stat of DirEntry is free on windows
+            for entry in os.scandir(dir_path):
+                try:
+                    ret[entry.name] = entry.stat(follow_symlinks=False)
+                except OSError:
+                    pass
+        else:
+            for name in os.listdir(dir_path):
+                try:
+                    ret[name] = os.lstat(os.path.join(dir_path, name))
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    return ret
+
+
+def _user_cache_dir():
+    """
+    cache directory only the current user can write, unlike the shared temp directory
+    """
+    base_dir = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base_dir, 'quickstartutil', 'cache')
+
+
+def _load_cache_file(path, serializer=pickle):
+    """
+    return the object saved by _save_cache_file, None if not exist or broken
+    :param serializer: pickle or marshal, marshal can not run code when the file is not trusted
+    """
+    try:
+        with open(path, 'rb') as fp:
+            return serializer.loads(fp.read())  # marshal reads a file object piece by piece
+    except Exception:
+        return None
+
+
+def _save_cache_file(path, obj, serializer=pickle):
+    """
+    save obj atomically, failures are ignored since a cache can always be rebuilt
+    """
+    temp_path = None
+    try:
+        dir_path = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(dir_path):
+            os.makedirs(dir_path)
+        fd, temp_path = tempfile.mkstemp(dir=dir_path)
+        with os.fdopen(fd, 'wb') as fp:
+            if serializer is pickle:
+                pickle.dump(obj, fp, pickle.HIGHEST_PROTOCOL)
+            else:
+                serializer.dump(obj, fp)
+        if hasattr(os, 'replace'):
+            os.replace(temp_path, path)
+        else:
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(temp_path, path)
+    except Exception:
+        _logger.warning(u'save cache file %s failed', _to_unicode_str(path), exc_info=True)
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
 def _raw_input_nonblock_win32():
     if msvcrt.kbhit():
         return _raw_input()
@@ -194,6 +490,47 @@ def raw_input_nonblock():
         raise NotImplementedError('Unsupported os.')
 
 
+class _TtlLruCache:
+    """
+    A thread safe memo with time-to-live and least-recently-used eviction.
+    """
+    _MISSING = object()
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = collections.OrderedDict()  # key -> (expire_time, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.pop(key, self._MISSING)
+            if item is self._MISSING:
+                return default
+            if item[0] <= _monotonic():
+                return default
+            self._items[key] = item
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (_monotonic() + self.ttl, value)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def get_or_call(self, key, func):
+        value = self.get(key, self._MISSING)
+        if value is self._MISSING:
+            value = func()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
 class _BaseOsx:
     class ChangeDirectory:
         def __init__(self, target):
@@ -201,69 +538,439 @@ class _BaseOsx:
             self.target = target
 
         def __enter__(self):
-            _logger.info(u'>>> cd %s', _to_unicode_str(self.target))
+            if _logger.isEnabledFor(logging.INFO):
+                _logger.info(u'>>> cd %s', _to_unicode_str(self.target))
             os.chdir(_to_local_str(self.target))
             return self
 
         def __exit__(self, exc_type, exc_value, exc_tb):
-            _logger.info(u'>>> cd %s', _to_unicode_str(self.old_cwd))
+            if _logger.isEnabledFor(logging.INFO):
+                _logger.info(u'>>> cd %s', _to_unicode_str(self.old_cwd))
             os.chdir(self.old_cwd)
 
+    class OutputStream:
+        """
+        Execute command and read it's output incrementally, the ERROR is kept aside.
+        Enter return the file object of OUTPUT.
+        Exit raise OsxSystemExecError on failure, if exit by exception a still running command is killed.
+        """
+        EXIT_GRACE_SECONDS = 1
+
+        def __init__(self, cmd, shell=False, timeout=None, cancel_event=None, cwd=None):
+            self.cmd = cmd
+            self.shell = shell
+            self.cwd = cwd
+            self.timeout = timeout
+            self.cancel_event = cancel_event
+            self.process = None
+            self.error_file = None
+            self.interrupted = None
+            self._watcher = None
+
+        def __enter__(self):
+            self.error_file = tempfile.TemporaryFile()
+            interruptible = self.timeout is not None or self.cancel_event is not None
+            self.process = _BaseOsx._popen(self.cmd, self.shell, subprocess.PIPE, self.error_file, interruptible, self.cwd)
+            if interruptible:
+                self._watcher = threading.Thread(target=self._watch)
+                self._watcher.daemon = True
+                self._watcher.start()
+            return self.process.stdout
+
+        def _watch(self):
+            self.interrupted = _BaseOsx._watch_process(self.process, self.timeout, self.cancel_event)
+
+        def __exit__(self, exc_type, exc_value, exc_tb):
+            try:
+                if exc_type is None:
+                    while self.process.stdout.read(65536):
+                        pass
+                elif exc_type is not GeneratorExit:
+                    # give a command that has written all it's output a moment to exit by itself
+                    deadline = _monotonic() + self.EXIT_GRACE_SECONDS
+                    while self.process.poll() is None and _monotonic() < deadline:
+                        time.sleep(0.01)
+                self.process.stdout.close()
+                if exc_type is not None and (exc_type is GeneratorExit or self.process.poll() is None):
+                    if self.process.poll() is None:
+                        _BaseOsx._kill_process_tree(self.process)
+                    self.process.wait()
+                    return False
+                retcode = self.process.wait()
+                if self._watcher is not None:
+                    self._watcher.join()
+                if self.interrupted is not None:
+                    raise _BaseOsx._interrupted_error(self.cmd, self.interrupted, self.timeout, None)
+                if retcode != 0:  # the failure of command is the cause of exception in most cases
+                    self.error_file.seek(0)
+                    error = self.error_file.read()
+                    final_code = _BaseOsx._fix_cmd_retcode(retcode)
+                    raise OsxSystemExecError(self.cmd, final_code, error, "subprocess.Popen failed(%d): %s" % (final_code, _to_unicode_str(error)))
+            finally:
+                self.error_file.close()
+
+    class Snapshot:
+        """
+        Compact index of a directory tree, see Osx.snapshot.
+        paths are relative(separated by '/', the root is ''), sizes, mtimes(nanoseconds) and modes are kept in arrays.
+        """
+        VERSION = 2
+
+        def __init__(self, root):
+            self.root = root
+            self.scan_time_ns = 0
+            self.paths = []
+            self.excludes = []
+            self.sizes = _int64_array()
+            self.mtimes = _int64_array()
+            self.modes = array.array('L')
+            self._index = None
+
+        def append(self, rel_path, size, mtime_ns, mode):
+            self.paths.append(rel_path)
+            self.sizes.append(size)
+            self.mtimes.append(mtime_ns)
+            self.modes.append(mode)
+            self._index = None
+
+        def index(self):
+            """
+            return dict of relative path -> position in the arrays
+            """
+            if self._index is None:
+                self._index = dict((rel_path, i) for i, rel_path in enumerate(self.paths))
+            return self._index
+
+        def children(self):
+            """
+            return dict of relative directory path -> positions of it's direct children
+            """
+            ret = {}
+            for i, rel_path in enumerate(self.paths):
+                if rel_path:
+                    ret.setdefault(posixpath.dirname(rel_path), []).append(i)
+            return ret
+
+        def diff(self, previous):
+            """
+            return dict with 'added', 'removed', 'changed' lists of relative paths,
+            directories are reported when added or removed, files when their size, mtime or mode changed
+            """
+            ret = {'added': [], 'removed': [], 'changed': []}
+            previous_index = {} if previous is None else previous.index()
+            for i, rel_path in enumerate(self.paths):
+                if not rel_path:
+                    continue
+                j = previous_index.get(rel_path)
+                if j is None:
+                    ret['added'].append(rel_path)
+                elif stat.S_IFMT(self.modes[i]) != stat.S_IFMT(previous.modes[j]):
+                    ret['changed'].append(rel_path)
+                elif not stat.S_ISDIR(self.modes[i]) and (self.sizes[i] != previous.sizes[j] or
+                                                          self.mtimes[i] != previous.mtimes[j] or
+                                                          self.modes[i] != previous.modes[j]):
+                    ret['changed'].append(rel_path)
+            if previous is not None:
+                index = self.index()
+                ret['removed'] = [rel_path for rel_path in previous.paths if rel_path and rel_path not in index]
+            return ret
+
+        def save(self, snapshot_file_path):
+            _save_cache_file(snapshot_file_path, (self.VERSION, self.root, self.scan_time_ns, self.excludes, '\0'.join(self.paths),
+                                                  self.sizes, self.mtimes, self.modes))
+
+        @classmethod
+        def load(cls, snapshot_file_path):
+            """
+            return None if not exist or broken
+            """
+            data = _load_cache_file(snapshot_file_path)
+            if data is None or data[0] != cls.VERSION:
+                return None
+            snapshot = cls(data[1])
+            snapshot.scan_time_ns = data[2]
+            snapshot.excludes = data[3]
+            snapshot.paths = data[4].split('\0')
+            snapshot.sizes, snapshot.mtimes, snapshot.modes = data[5], data[6], data[7]
+            return snapshot
+
+    # directories modified within this time before the last scan may change again without a new mtime
+    SNAPSHOT_MTIME_GRANULARITY_NS = 2000000000
+
+    @classmethod
+    def snapshot(cls, path, snapshot_file_path=None, excludes=None, check_files=True, relist=False):
+        """
+        Scan a directory tree and compare it with the snapshot saved by the last scan.
+        Only directories whose mtime changed are listed again, the listings of the others are reused.
+        The listings of the last snapshot are not reused if it was scanned with other excludes.
+        :param snapshot_file_path: None or file to load the last snapshot from and save the new one to
+        :param excludes: None or list of glob patterns matched against the relative path(separated by '/') or name
+        :param check_files: if True files in unchanged directories are still stat one by one to find modified files,
+            which costs about as much as a full walk, if False only added and removed files are found
+        :param relist: if True all directories are listed again, with check_files it may be faster on windows
+            where os.scandir gives the stat of files for free
+        :return: tuple(Osx.Snapshot, dict of changes see Osx.Snapshot.diff)
+        :except: OsxPathNotExistError
+        """
+        if not cls.is_path_exist(path):
+            raise OsxPathNotExistError(path)
+        excludes = list(excludes or [])
+        root = os.path.abspath(path)
+        previous = None if snapshot_file_path is None else cls.Snapshot.load(snapshot_file_path)
+        if previous is not None and previous.root != root:
+            previous = None
+        # the paths excluded by the last scan are missing from it's listings
+        previous_index = {} if previous is None or previous.excludes != excludes or relist else previous.index()
+        previous_children = {} if previous is None else previous.children()
+        reuse_before_ns = 0 if previous is None else previous.scan_time_ns - cls.SNAPSHOT_MTIME_GRANULARITY_NS
+
+        snapshot = cls.Snapshot(root)
+        snapshot.excludes = excludes
+        snapshot.scan_time_ns = int(time.time() * 1000000000)
+        pending_dirs = [('', None)]
+        while pending_dirs:
+            rel_dir, st = pending_dirs.pop()
+            abs_dir = os.path.join(root, rel_dir)
+            if st is None:
+                try:
+                    st = os.lstat(abs_dir)
+                except OSError:
+                    continue
+            mtime_ns = _stat_mtime_ns(st)
+            snapshot.append(rel_dir, st.st_size, mtime_ns, st.st_mode)
+
+            i = previous_index.get(rel_dir)
+            if i is not None and stat.S_ISDIR(previous.modes[i]) and previous.mtimes[i] == mtime_ns and mtime_ns < reuse_before_ns:
+                for j in previous_children.get(rel_dir, ()):
+                    rel_path = previous.paths[j]
+                    if stat.S_ISDIR(previous.modes[j]):
+                        pending_dirs.append((rel_path, None))
+                    elif check_files:
+                        try:
+                            child_st = os.lstat(os.path.join(root, rel_path))
+                        except OSError:
+                            continue
+                        snapshot.append(rel_path, child_st.st_size, _stat_mtime_ns(child_st), child_st.st_mode)
+                    else:
+                        snapshot.append(rel_path, previous.sizes[j], previous.mtimes[j], previous.modes[j])
+                continue
+
+            for name, child_st in _lstat_dir_entries(abs_dir).items():
+                rel_path = rel_dir + '/' + name if rel_dir else name
+                if cls._is_excluded(rel_path, name, excludes):
+                    continue
+                if stat.S_ISDIR(child_st.st_mode):
+                    pending_dirs.append((rel_path, child_st))
+                else:
+                    snapshot.append(rel_path, child_st.st_size, _stat_mtime_ns(child_st), child_st.st_mode)
+
+        changes = snapshot.diff(previous)
+        if snapshot_file_path is not None:
+            snapshot.save(snapshot_file_path)
+        return snapshot, changes
+
     @classmethod
     def _fix_cmd_retcode(cls, retcode):
         return retcode if _IS_OS_WIN32 else (retcode >> 8)
 
+    WATCH_INTERVAL_SECONDS = 0.05
+    READER_GRACE_SECONDS = 0.2
+
+    @classmethod
+    def _popen(cls, cmd, shell, stdout, stderr, interruptible, cwd=None, env=None):
+        kwargs = {}
+        if interruptible and not _IS_OS_WIN32:
+            # run in it's own process group to be killed as a whole
+            if _PY3:
+                kwargs['start_new_session'] = True
+            else:
+                kwargs['preexec_fn'] = os.setsid
+        if cwd is not None:  # only the child changes directory, safe for threads unlike ChangeDirectory
+            kwargs['cwd'] = _to_local_str(cwd)
+        if env:  # only the child sees the variables, safe for threads unlike os.environ
+            kwargs['env'] = dict(os.environ, **env)
+        return subprocess.Popen(_to_local_str(cmd), stdout=stdout, stderr=stderr, shell=shell, **kwargs)
+
+    @classmethod
+    def _kill_process_tree(cls, process):
+        try:
+            if _IS_OS_WIN32:
+                with open(os.devnull, 'w') as devnull:
+                    subprocess.call('taskkill /F /T /PID %d' % process.pid, stdout=devnull, stderr=devnull)
+            else:
+                os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        if process.poll() is None:
+            try:
+                process.kill()
+            except OSError:
+                pass
+        process.wait()
+
     @classmethod
-    def _system_exec_1(cls, cmd, shell=False):
+    def _watch_process(cls, process, timeout, cancel_event):
+        """
+        Wait process complete, kill it's process tree on timeout or cancel.
+        return None, 'timeout' or 'cancelled'
+        """
+        deadline = None if timeout is None else _monotonic() + timeout
+        while process.poll() is None:
+            interrupted = cls._check_interrupted(deadline, cancel_event)
+            if interrupted is not None:
+                cls._kill_process_tree(process)
+                return interrupted
+            time.sleep(cls.WATCH_INTERVAL_SECONDS)
+        return None
+
+    @classmethod
+    def _check_interrupted(cls, deadline, cancel_event):
+        if cancel_event is not None and cancel_event.is_set():
+            return 'cancelled'
+        if deadline is not None and _monotonic() >= deadline:
+            return 'timeout'
+        return None
+
+    @classmethod
+    def _interrupted_error(cls, cmd, interrupted, timeout, output):
+        if interrupted == 'timeout':
+            return OsxSystemExecTimeoutError(cmd, output, timeout)
+        return OsxSystemExecCancelledError(cmd, output)
+
+    @classmethod
+    def _run(cls, cmd, shell, capture_output, timeout, cancel_event, cwd, env=None):
+        """
+        Execute command and wait complete, the ERROR is merged into OUTPUT.
+        return tuple(retcode, output), output is None if not capture_output
+        :except: OsxSystemExecInterruptedError on timeout or cancel
+        """
+        interruptible = timeout is not None or cancel_event is not None
+        process = cls._popen(cmd, shell, subprocess.PIPE if capture_output else None, subprocess.STDOUT, interruptible, cwd, env)
+        if not interruptible:
+            output = process.communicate()[0]
+            return process.returncode, output
+
+        deadline = None if timeout is None else _monotonic() + timeout
+        chunks = []
+        reader = None
+        if capture_output:
+            # read in another thread to keep the pipe from blocking the command,
+            # the thread owns a duplicate of the pipe so that it can be abandoned safely
+            reader = threading.Thread(target=cls._read_pipe, args=(os.dup(process.stdout.fileno()), chunks))
+            reader.daemon = True
+            reader.start()
+        interrupted = cls._watch_process(process, None if deadline is None else max(0, deadline - _monotonic()), cancel_event)
+        output = None
+        if reader is not None:
+            # a descendant escaped from the killed process tree may still hold the pipe
+            if interrupted is not None:
+                reader.join(cls.READER_GRACE_SECONDS)
+            else:
+                while reader.is_alive():
+                    reader.join(cls.WATCH_INTERVAL_SECONDS)
+                    interrupted = cls._check_interrupted(deadline, cancel_event)
+                    if interrupted is not None:
+                        break
+            process.stdout.close()
+            output = b''.join(list(chunks))
+        if interrupted is not None:
+            raise cls._interrupted_error(cmd, interrupted, timeout, output)
+        return process.returncode, output
+
+    @classmethod
+    def _read_pipe(cls, fd, chunks):
+        try:
+            while True:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        finally:
+            os.close(fd)
+
+    @classmethod
+    def _log_command(cls, cmd, cwd):
+        if _logger.isEnabledFor(logging.INFO):
+            if cwd is None:
+                _logger.info(u'>>> %s', _to_unicode_str(cmd))
+            else:
+                _logger.info(u'>>> [%s] %s', _to_unicode_str(cwd), _to_unicode_str(cmd))
+
+    @classmethod
+    def _system_exec_1(cls, cmd, shell=False, timeout=None, cancel_event=None, cwd=None):
         """
         Execute command and wait complete.
         The normal output & error will output to console.
         It's recommended for long time operation.
         :except: raise SystemCallError on failure
         """
-        _logger.info(u'>>> %s' % _to_unicode_str(cmd))
-        try:
-            subprocess.check_call(_to_local_str(cmd), stderr=subprocess.STDOUT, shell=shell)
-        except subprocess.CalledProcessError as e:
-            final_code = cls._fix_cmd_retcode(e.returncode)
-            raise OsxSystemExecError(cmd, final_code, None, "subprocess.check_call failed(%d): %s" % (final_code, e))
+        cls._log_command(cmd, cwd)
+        retcode, output = cls._run(cmd, shell, False, timeout, cancel_event, cwd)
+        if retcode != 0:
+            final_code = cls._fix_cmd_retcode(retcode)
+            raise OsxSystemExecError(cmd, final_code, None, "subprocess.check_call failed(%d): Command '%s' returned non-zero exit status %d" %
+                                     (final_code, cmd, retcode))
 
     @classmethod
-    def _system_exec_2(cls, cmd, shell=False):
-        _logger.info(u'>>> %s' % _to_unicode_str(cmd))
+    def _system_exec_2(cls, cmd, shell=False, timeout=None, cancel_event=None, cwd=None):
+        cls._log_command(cmd, cwd)
         try:
-            output = subprocess.check_output(_to_local_str(cmd), stderr=subprocess.STDOUT, shell=shell)
+            retcode, output = cls._run(cmd, shell, True, timeout, cancel_event, cwd)
+        except OsxSystemExecInterruptedError as e:
+            if _logger.isEnabledFor(logging.ERROR):
+                _logger.error(u'%s\n%s', e, _to_unicode_str(e.output))
+            raise
+        if retcode != 0:
+            if _logger.isEnabledFor(logging.ERROR):
+                _logger.error(_to_unicode_str(output))
+            final_code = cls._fix_cmd_retcode(retcode)
+            raise OsxSystemExecError(cmd, final_code, output, "subprocess.check_output failed(%d): Command '%s' returned non-zero exit status %d" %
+                                     (final_code, cmd, retcode))
+        if _logger.isEnabledFor(logging.INFO):
             _logger.info(_to_unicode_str(output))
-        except subprocess.CalledProcessError as e:
-            _logger.error(_to_unicode_str(e.output))
-            final_code = cls._fix_cmd_retcode(e.returncode)
-            raise OsxSystemExecError(cmd, final_code, e.output, "subprocess.check_output failed(%d): %s" % (final_code, e))
 
     @classmethod
-    def system_exec(cls, cmd, shell=False, redirect_output_to_log=False):
+    def system_exec(cls, cmd, shell=False, redirect_output_to_log=False, timeout=None, cancel_event=None, cwd=None):
         """
         Execute command and wait complete.
         :param: redirect_output_to_log:
           True: OUTPUT & ERROR will redirect to the logger
           False: OUTPUT & ERROR will output to console. It's recommended for long-time operation
-        :except: raise OsxSystemExecError on failure
+        :param timeout: None or seconds, the process tree of command is killed when exceeded
+        :param cancel_event: None or threading.Event, the process tree of command is killed when it is set
+        :param cwd: None or working directory of the command, unlike ChangeDirectory it's safe for threads
+        :except: raise OsxSystemExecError on failure, OsxSystemExecTimeoutError/OsxSystemExecCancelledError if killed
         """
         if redirect_output_to_log:
-            cls._system_exec_2(cmd, shell)
+            cls._system_exec_2(cmd, shell, timeout, cancel_event, cwd)
         else:
-            cls._system_exec_1(cmd, shell)
+            cls._system_exec_1(cmd, shell, timeout, cancel_event, cwd)
 
     @classmethod
-    def system_output(cls, cmd, shell=False):
+    def system_output(cls, cmd, shell=False, timeout=None, cancel_event=None, cwd=None, env=None):
         """
         Execute command and return it's output
-        raise OsxSystemExecError on failure
+        :param timeout, cancel_event, cwd: see system_exec
+        :param env: None or dict of environment variables added to the command's environment
+        raise OsxSystemExecError on failure, OsxSystemExecTimeoutError/OsxSystemExecCancelledError if killed
         """
-        try:
-            return subprocess.check_output(_to_local_str(cmd), stderr=subprocess.STDOUT, shell=shell)
-        except subprocess.CalledProcessError as e:
-            final_code = e.returncode if _IS_OS_WIN32 else (e.returncode >> 8)
-            raise OsxSystemExecError(cmd, final_code, e.output, "subprocess.check_output failed(%d): %s" % (final_code, e))
+        retcode, output = cls._run(cmd, shell, True, timeout, cancel_event, cwd, env)
+        if retcode != 0:
+            final_code = cls._fix_cmd_retcode(retcode)
+            raise OsxSystemExecError(cmd, final_code, output, "subprocess.check_output failed(%d): Command '%s' returned non-zero exit status %d" %
+                                     (final_code, cmd, retcode))
+        return output
+
+    @classmethod
+    def system_output_stream(cls, cmd, shell=False, timeout=None, cancel_event=None, cwd=None):
+        """
+        Execute command and read it's output incrementally:
+            with osx.system_output_stream(cmd) as stream:
+                for line in stream: ...
+        :param timeout, cancel_event, cwd: see system_exec
+        raise OsxSystemExecError on failure, OsxSystemExecTimeoutError/OsxSystemExecCancelledError if killed
+        """
+        return cls.OutputStream(cmd, shell, timeout, cancel_event, cwd)
 
     @classmethod
     def is_path_exist(cls, path):
@@ -277,17 +984,129 @@ class _BaseOsx:
     def is_file(cls, path):
         return os.path.isfile(_to_local_str(path))
 
+    @classmethod
+    def _is_excluded(cls, rel_path, name, excludes):
+        for pattern in excludes:
+            if fnmatch.fnmatch(rel_path, pattern) or fnmatch.fnmatch(name, pattern):
+                return True
+        return False
+
+    @classmethod
+    def _hash_file(cls, file_path, st, algorithm, buffer_size=1048576):
+        h = hashlib.new(algorithm)
+        if stat.S_ISLNK(st.st_mode):
+            target = os.readlink(file_path)
+            h.update(target if isinstance(target, bytes) else target.encode('utf8'))
+            return h.hexdigest()
+        buf = bytearray(max(1, min(buffer_size, st.st_size)))  # small files are the most, don't zero a large buffer for each
+        view = memoryview(buf)
+        with open(file_path, 'rb', 0) as fp:
+            while True:
+                n = fp.readinto(buf)
+                if not n:
+                    break
+                h.update(view[:n])
+        return h.hexdigest()
+
+    @classmethod
+    def tree_digest(cls, path, excludes=None, workers=8, stat_cache_path=None, algorithm='sha1'):
+        """
+        Content fingerprint of a directory tree, files are hashed in parallel.
+        The digest of a directory is the hash of it's sorted children's kinds, names and digests,
+        so it changes whenever any file content, name or directory structure changed.
+        :param excludes: None or list of glob patterns matched against the relative path(separated by '/') or name
+        :param stat_cache_path: None or file to persist file hashes of this tree, files with the same inode, size and mtime are not re-read
+        :return: tuple(digest, dict of relative path -> hash of file)
+        :except: OsxPathNotExistError, OsxPathTypeUnsupportedError if path is not a directory
+        """
+        if not cls.is_path_exist(path):
+            raise OsxPathNotExistError(path)
+        if not cls.is_dir(path):
+            raise OsxPathTypeUnsupportedError(path, "'%s' is not a directory" % path)
+        excludes = excludes or []
+        files = []  # (rel_path, stat)
+        dir_children = {}  # rel_dir -> [(kind, name, rel_path)]
+        pending_dirs = ['']
+        while pending_dirs:
+            rel_dir = pending_dirs.pop()
+            children = dir_children.setdefault(rel_dir, [])
+            for name, st in _lstat_dir_entries(os.path.join(path, rel_dir)).items():
+                rel_path = rel_dir + '/' + name if rel_dir else name
+                if cls._is_excluded(rel_path, name, excludes):
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    children.append(('d', name, rel_path))
+                    pending_dirs.append(rel_path)
+                elif stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode):
+                    children.append(('f', name, rel_path))
+                    files.append((rel_path, st))
+
+        cache_key = ('tree_digest', algorithm, os.path.abspath(path))  # the inode is always 0 on windows, never share between trees
+        cached = {}
+        if stat_cache_path is not None:
+            cache = _load_cache_file(stat_cache_path)
+            if cache is not None and cache[0] == cache_key:
+                cached = cache[1]
+
+        def hash_file(item):
+            rel_path, st = item
+            file_stat = (st.st_ino, st.st_size, _stat_mtime_ns(st))
+            cached_item = cached.get(rel_path)
+            if cached_item is not None and cached_item[0] == file_stat:
+                return rel_path, cached_item
+            return rel_path, (file_stat, cls._hash_file(os.path.join(path, rel_path), st, algorithm))
+
+        file_items = dict(_parallel_map(hash_file, files, workers))
+        if stat_cache_path is not None:
+            _save_cache_file(stat_cache_path, (cache_key, file_items))
+        file_hashes = dict((rel_path, item[1]) for rel_path, item in file_items.items())
+
+        dir_digests = {}
+        for rel_dir in sorted(dir_children, key=lambda d: d.count('/') + (1 if d else 0), reverse=True):
+            h = hashlib.new(algorithm)
+            for kind, name, rel_path in sorted(dir_children[rel_dir]):
+                digest = file_hashes[rel_path] if kind == 'f' else dir_digests[rel_path]
+                h.update(('%s %s %s\n' % (kind, name, digest)).encode('utf8'))
+            dir_digests[rel_dir] = h.hexdigest()
+        return dir_digests[''], file_hashes
+
     def __init__(self):
         self.redirect_output_to_log = False
+        self.timeout = None
+        self.cancel_event = None
 
     def set_redirect_output_to_log(self, redirect_output_to_log=True):
         self.redirect_output_to_log = redirect_output_to_log
 
-    def exec_command(self, cmd, shell=False):
-        self.system_exec(cmd, shell=shell, redirect_output_to_log=self.redirect_output_to_log)
+    def set_timeout(self, timeout):
+        """
+        default timeout in seconds of commands, None for no timeout
+        """
+        self.timeout = timeout
 
-    def exec_command_output(self, cmd, shell=False):
-        return self.system_output(cmd, shell=shell)
+    def set_cancel_event(self, cancel_event):
+        """
+        default cancel event(threading.Event) of commands, running commands are killed when it is set
+        """
+        self.cancel_event = cancel_event
+
+    def exec_command(self, cmd, shell=False, timeout=None, cancel_event=None, cwd=None):
+        self.system_exec(cmd, shell=shell, redirect_output_to_log=self.redirect_output_to_log,
+                         timeout=self.timeout if timeout is None else timeout,
+                         cancel_event=self.cancel_event if cancel_event is None else cancel_event,
+                         cwd=cwd)
+
+    def exec_command_output(self, cmd, shell=False, timeout=None, cancel_event=None, cwd=None, env=None):
+        return self.system_output(cmd, shell=shell,
+                                  timeout=self.timeout if timeout is None else timeout,
+                                  cancel_event=self.cancel_event if cancel_event is None else cancel_event,
+                                  cwd=cwd, env=env)
+
+    def exec_command_output_stream(self, cmd, shell=False, timeout=None, cancel_event=None, cwd=None):
+        return self.system_output_stream(cmd, shell=shell,
+                                         timeout=self.timeout if timeout is None else timeout,
+                                         cancel_event=self.cancel_event if cancel_event is None else cancel_event,
+                                         cwd=cwd)
 
 class _Osx_Win32(_BaseOsx):
     def __init__(self):
@@ -302,11 +1121,14 @@ class _Osx_Win32(_BaseOsx):
                 break
         return shell
 
-    def exec_command(self, cmd):
-        return _BaseOsx.exec_command(self, cmd, self._is_shell_command(cmd))
+    def exec_command(self, cmd, timeout=None, cancel_event=None, cwd=None):
+        return _BaseOsx.exec_command(self, cmd, self._is_shell_command(cmd), timeout, cancel_event, cwd)
+
+    def exec_command_output(self, cmd, timeout=None, cancel_event=None, cwd=None, env=None):
+        return _BaseOsx.exec_command_output(self, cmd, self._is_shell_command(cmd), timeout, cancel_event, cwd, env)
 
-    def exec_command_output(self, cmd):
-        return _BaseOsx.exec_command_output(self, cmd, self._is_shell_command(cmd))
+    def exec_command_output_stream(self, cmd, timeout=None, cancel_event=None, cwd=None):
+        return _BaseOsx.exec_command_output_stream(self, cmd, self._is_shell_command(cmd), timeout, cancel_event, cwd)
 
     def remove_path(self, path, force=True):
         """
@@ -387,6 +1209,15 @@ class Svn:
     RESOLVE_ACCEPT_MINE_FULL = 'mine-full'
     RESOLVE_ACCEPT_THEIRS_FULL = 'theirs-full'
 
+    # limits for commands taking many targets, keep them far below the windows command line limit
+    MAX_TARGETS_PER_COMMAND = 100
+    MAX_TARGETS_LENGTH_PER_COMMAND = 6000
+
+    # the notifications are translated, force untranslated messages where they are parsed
+    _UNTRANSLATED_MESSAGES_ENV = {'LC_MESSAGES': 'C', 'LANGUAGE': 'en'}
+    _NOTIFY_LOCKED_PATTERN = re.compile(r"^'(.+)' locked by user '.*'\.\s*$", re.MULTILINE)
+    _NOTIFY_UNLOCKED_PATTERN = re.compile(r"^'(.+)' unlocked\.\s*$", re.MULTILINE)
+
     @classmethod
     def stringing_user_pass_option(cls, user_pass):
         s = ''
@@ -430,11 +1261,64 @@ class Svn:
                 return True
         return False
 
+    @classmethod
+    def split_path_list(cls, path_list):
+        """
+        split path list into chunks small enough to be passed to a single svn command
+        """
+        if not (isinstance(path_list, tuple) or isinstance(path_list, list)):
+            path_list = [path_list]
+        chunk = []
+        chunk_length = 0
+        for path in path_list:
+            if chunk and (len(chunk) >= cls.MAX_TARGETS_PER_COMMAND or
+                          chunk_length + len(path) + 1 > cls.MAX_TARGETS_LENGTH_PER_COMMAND):
+                yield chunk
+                chunk = []
+                chunk_length = 0
+            chunk.append(path)
+            chunk_length += len(path) + 1
+        if chunk:
+            yield chunk
+
+    @classmethod
+    def _path_key(cls, path):
+        """
+        svn prints local paths relative to the current directory in its own style, normalize before comparing
+        """
+        if cls.is_url(path):
+            return path.rstrip('/')
+        return os.path.normcase(os.path.abspath(path))
+
     def __init__(self, user_pass=None, interactive=False):
         self.base_command = 'svn'
         self.str_user_pass_option = self.stringing_user_pass_option(user_pass)
         self.str_interactive_option = '' if interactive else '--non-interactive'
         self.osx = Osx()
+        self.cache = None
+
+    def set_cache(self, ttl=5, max_size=1024):
+        """
+        Memo symbolic revision resolution and path existence probes for ttl seconds.
+        The memo is cleared by the mutating methods of this object, changes made by others are seen after ttl.
+        :param ttl: seconds, None or 0 to disable the memo
+        """
+        self.cache = _TtlLruCache(ttl, max_size) if ttl else None
+
+    def clear_cache(self):
+        if self.cache is not None:
+            self.cache.clear()
+
+    def _cached(self, key, func):
+        if self.cache is None:
+            return func()
+        return self.cache.get_or_call(key, func)
+
+    def _exec_mutating_sub_command(self, sub_command):
+        try:
+            self.exec_sub_command(sub_command)
+        finally:
+            self.clear_cache()  # a command failed partway may have changed the working copy as well
 
     def set_base_command(self, base_command):
         self.base_command = base_command
@@ -442,18 +1326,45 @@ class Svn:
     def set_redirect_output_to_log(self, redirect_output_to_log=True):
         self.osx.set_redirect_output_to_log(redirect_output_to_log)
 
-    def exec_sub_command(self, sub_command):
-        self.osx.exec_command(self.base_command + ' ' + sub_command + ' ' + self.str_interactive_option)
+    def set_timeout(self, timeout):
+        self.osx.set_timeout(timeout)
+
+    def set_cancel_event(self, cancel_event):
+        self.osx.set_cancel_event(cancel_event)
+
+    def exec_sub_command(self, sub_command, timeout=None, cancel_event=None, cwd=None):
+        self.osx.exec_command(self.base_command + ' ' + sub_command + ' ' + self.str_interactive_option, timeout, cancel_event, cwd)
+
+    def exec_sub_command_output(self, sub_command, timeout=None, cancel_event=None, cwd=None, env=None):
+        return self.osx.exec_command_output(self.base_command + ' ' + sub_command + ' ' + self.str_interactive_option, timeout, cancel_event, cwd, env)
+
+    def exec_sub_command_output_stream(self, sub_command, timeout=None, cancel_event=None, cwd=None):
+        return self.osx.exec_command_output_stream(self.base_command + ' ' + sub_command + ' ' + self.str_interactive_option, timeout, cancel_event, cwd)
 
-    def exec_sub_command_output(self, sub_command):
-        return self.osx.exec_command_output(self.base_command + ' ' + sub_command + ' ' + self.str_interactive_option)
+    def _exec_sub_command_output_ignore_failure(self, sub_command, env=None):
+        """
+        for commands that handle many targets and report failed ones as warnings but still exit with error
+        """
+        try:
+            return self.exec_sub_command_output(sub_command, env=env)
+        except OsxSystemExecInterruptedError:
+            raise
+        except OsxSystemExecError as e:
+            if e.output is None:
+                raise
+            return e.output
 
     def is_valid_svn_path(self, path):
+        return self._cached(('is_valid_svn_path', self._path_key(path)), lambda: self._is_valid_svn_path(path))
+
+    def _is_valid_svn_path(self, path):
         cmd = 'info ' + path
         if self.is_url(path):
             cmd += ' ' + self.str_user_pass_option
         try:
             self.exec_sub_command_output(cmd)
+        except OsxSystemExecInterruptedError:
+            raise
         except OsxSystemExecError as e:
             return False
         return True
@@ -464,7 +1375,9 @@ class Svn:
         """
         if isinstance(revision, int):
             return revision
+        return self._cached(('get_revision_number', self._path_key(path), revision), lambda: self._get_revision_number(path, revision))
 
+    def _get_revision_number(self, path, revision):
         cmd = 'info ' + path
         cmd += ' --xml'
         cmd += ' ' + self.stringing_revision_option(revision)
@@ -475,16 +1388,8 @@ class Svn:
         entry_node = root.find('entry')
         return int(entry_node.attrib['revision'])
 
-    def info_dict(self, path='.', revision='HEAD'):
-        cmd = 'info ' + path
-        cmd += ' --xml'
-        cmd += ' ' + self.stringing_revision_option(revision)
-        if self.is_url(path):
-            cmd += ' ' + self.str_user_pass_option
-        result = self.exec_sub_command_output(cmd)
-        root = ElementTree.fromstring(result)
-        entry_node = root.find('entry')
-
+    @classmethod
+    def _parse_info_entry(cls, entry_node):
         ret = {}
         ret['#kind'] = entry_node.attrib['kind']
         ret['#path'] = entry_node.attrib['path']
@@ -528,6 +1433,16 @@ class Svn:
 
         return ret
 
+    def info_dict(self, path='.', revision='HEAD'):
+        cmd = 'info ' + path
+        cmd += ' --xml'
+        cmd += ' ' + self.stringing_revision_option(revision)
+        if self.is_url(path):
+            cmd += ' ' + self.str_user_pass_option
+        result = self.exec_sub_command_output(cmd)
+        root = ElementTree.fromstring(result)
+        return self._parse_info_entry(root.find('entry'))
+
     def log(self, path='.', revision_or_range=('HEAD', 1), limit=None, show_detail_changes=False, search_pattern=None):
         """
         :param path: working copy path or remote url
@@ -585,17 +1500,74 @@ class Svn:
                     path['#action'] = path_node.attrib['action']
         return ret
 
+    @classmethod
+    def _unquote_url(cls, url):
+        if _PY3:
+            return _url_unquote(url)
+        return _url_unquote(_to_unicode_str(url).encode('utf8')).decode('utf8')
+
+    def changed_paths(self, path, revision_a, revision_b, patterns=None):
+        """
+        Net changes of path between two revisions, deleted or replaced intermediate changes are not included.
+        :param path: working copy path or remote url
+        :param patterns: None or list of glob patterns, only matched relative paths are returned
+        :return: dict of relative path -> change, e.g.
+            {'src/a.c': {'#item': 'modified', '#props': 'none', '#kind': 'file'}}
+            '#item' can be 'added', 'modified', 'deleted' or 'none'(property changes only)
+        """
+        cmd = 'diff ' + path
+        cmd += ' --summarize --xml'
+        cmd += ' ' + self.stringing_revision_or_range_option((revision_a, revision_b))
+        if self.is_url(path):
+            cmd += ' ' + self.str_user_pass_option
+            base = self._unquote_url(path).rstrip('/')  # svn prints the escaped url, which the caller may not
+        else:
+            base = None
+
+        ret = {}
+        with self.exec_sub_command_output_stream(cmd) as stream:
+            paths_node = None
+            for event, node in ElementTree.iterparse(stream, events=('start', 'end')):
+                if event == 'start':
+                    if node.tag == 'paths':
+                        paths_node = node
+                    continue
+                if node.tag != 'path':
+                    continue
+
+                changed_path = node.text
+                if not changed_path:
+                    continue
+                if base is None:
+                    changed_path = os.path.relpath(changed_path, path).replace(os.sep, '/')
+                else:
+                    changed_path = self._unquote_url(changed_path).rstrip('/')
+                    if changed_path == base:
+                        changed_path = '.'
+                    elif changed_path.startswith(base + '/'):
+                        changed_path = changed_path[len(base) + 1:]
+                    else:
+                        continue  # not under path
+                if patterns is None or any(fnmatch.fnmatch(changed_path, pattern) for pattern in patterns):
+                    ret[changed_path] = {
+                        '#item': node.attrib['item'],
+                        '#props': node.attrib['props'],
+                        '#kind': node.attrib['kind'],
+                    }
+                paths_node.clear()  # release parsed nodes
+        return ret
+
     def checkout(self, url, path='.', revision='HEAD'):
         cmd = 'checkout ' + url + ' ' + path
         cmd += ' ' + self.stringing_revision_option(revision)
         cmd += ' ' + self.str_user_pass_option
-        self.exec_sub_command(cmd)
+        self._exec_mutating_sub_command(cmd)
 
     def update(self, path_list='.', revision='HEAD'):
         cmd = 'update ' + self.stringing_path_list(path_list)
         cmd += ' ' + self.stringing_revision_option(revision)
         cmd += ' ' + self.str_user_pass_option
-        self.exec_sub_command(cmd)
+        self._exec_mutating_sub_command(cmd)
 
     def update_or_checkout(self, url, path='.', revision='HEAD'):
         if os.path.exists(path):
@@ -605,7 +1577,7 @@ class Svn:
 
     def add(self, path_list):
         cmd = 'add ' + self.stringing_path_list(path_list)
-        self.exec_sub_command(cmd)
+        self._exec_mutating_sub_command(cmd)
 
     def commit(self, msg, path_list='.', include_external=False):
         """
@@ -620,7 +1592,7 @@ class Svn:
             cmd += ' --include-externals'
         cmd += ' ' + self.stringing_message_option(msg)
         cmd += ' ' + self.str_user_pass_option
-        self.exec_sub_command(cmd)
+        self._exec_mutating_sub_command(cmd)
 
     def resolve(self, path_list, accept_arg, recursive=True, quiet=True):
         """
@@ -647,7 +1619,7 @@ class Svn:
         cmd = 'revert ' + self.stringing_path_list(path_list)
         if recursive is not None:
             cmd += ' -R'
-        self.exec_sub_command(cmd)
+        self._exec_mutating_sub_command(cmd)
 
     def clear_all(self, path='.'):
         self.clear_work_queue(path)
@@ -671,6 +1643,181 @@ class Svn:
         self.exec_sub_command('propset svn:externals -F %s %s' % (temp_external_file_path, dir) )
         os.remove(temp_external_file_path)
 
+    @classmethod
+    def _parse_externals_definition(cls, line):
+        """
+        parse a line of svn:externals in either format:
+            [-r REV] URL[@PEG] SUBDIR   (svn 1.5+)
+            SUBDIR [-r REV] URL
+        return tuple(subdir, url, peg_revision, operative_revision) or None for blank or comment line
+        """
+        line = line.strip()
+        if not line or line.startswith('#'):
+            return None
+        try:
+            tokens = shlex.split(line)
+        except ValueError:
+            tokens = line.split()
+
+        operative_revision = None
+        rest = []
+        i = 0
+        while i < len(tokens):
+            if tokens[i] == '-r' and i + 1 < len(tokens):
+                operative_revision = tokens[i + 1]
+                i += 2
+            elif tokens[i].startswith('-r') and len(tokens[i]) > 2:
+                operative_revision = tokens[i][2:]
+                i += 1
+            else:
+                rest.append(tokens[i])
+                i += 1
+        if len(rest) != 2:
+            return None
+
+        peg_revision = None
+        if '://' in rest[0] or rest[0].startswith(('^/', '//', '/', '../')):
+            url, subdir = rest
+            at = url.rfind('@')
+            if at > url.rfind('/'):
+                url, peg_revision = url[:at], url[at + 1:]
+        else:  # old format, the url is absolute
+            subdir, url = rest
+        return subdir, url, peg_revision, operative_revision
+
+    @classmethod
+    def _resolve_external_url(cls, url, dir_url, repos_root):
+        """
+        resolve relative external url(^/, //, /, ../) against the url of the directory holding the property
+        """
+        if url.startswith('^/'):
+            url = repos_root.rstrip('/') + '/' + url[2:]
+        elif url.startswith('//'):
+            return dir_url.split(':', 1)[0] + ':' + url
+        elif url.startswith('/'):
+            return re.match(r'^[^:]+://[^/]*', dir_url).group(0) + url
+        elif url.startswith('../'):
+            url = dir_url.rstrip('/') + '/' + url
+        else:
+            return url
+        server, path = re.match(r'^([^:]+://[^/]*)(.*)$', url).groups()
+        return server + posixpath.normpath(path)
+
+    def _query_externals(self, targets, revision):
+        """
+        externals defined in targets recursively, all targets are working copy paths or urls at the same revision
+        """
+        is_url = self.is_url(targets[0])
+
+        # url and repository root of targets to resolve relative urls, the sub directories share them
+        target_infos = []
+        for entry in self._info_entries(targets, revision):
+            target_path = entry['url'].rstrip('/') if is_url else os.path.abspath(entry['#path'])
+            target_infos.append((self._path_key(target_path), target_path, entry['url'], entry['repository']['root']))
+        target_infos.sort(key=lambda item: len(item[0]), reverse=True)
+
+        cmd = 'propget svn:externals -R --xml ' + self.stringing_path_list(targets)
+        cmd += ' ' + self.stringing_revision_option(revision)
+        if is_url:
+            cmd += ' ' + self.str_user_pass_option
+
+        ret = []
+        with self.exec_sub_command_output_stream(cmd) as stream:
+            properties_node = None
+            dir = None
+            for event, node in ElementTree.iterparse(stream, events=('start', 'end')):
+                if event == 'start':
+                    if node.tag == 'properties':
+                        properties_node = node
+                    elif node.tag == 'target':
+                        dir = node.attrib['path']
+                    continue
+                if node.tag == 'target':
+                    properties_node.clear()  # release parsed nodes
+                    continue
+                if node.tag != 'property' or node.attrib.get('name') != 'svn:externals':
+                    continue
+
+                # normcase lowers the case on windows, only compare with keys but slice the original path
+                dir_path = dir.rstrip('/') if is_url else os.path.abspath(dir)
+                dir_key = self._path_key(dir_path)
+                dir_url, repos_root = dir, ''
+                for target_key, target_path, target_url, target_repos_root in target_infos:
+                    if dir_key == target_key or dir_key.startswith(target_key + ('/' if is_url else os.sep)):
+                        relative_dir = dir_path[len(target_path):].lstrip('/' if is_url else os.sep)
+                        if not is_url:
+                            relative_dir = _url_quote(relative_dir.replace(os.sep, '/').encode('utf8'))
+                        dir_url = target_url.rstrip('/') + ('/' + relative_dir if relative_dir else '')
+                        repos_root = target_repos_root
+                        break
+
+                for line in (node.text or '').splitlines():
+                    definition = self._parse_externals_definition(line)
+                    if definition is None:
+                        continue
+                    subdir, url, peg_revision, operative_revision = definition
+                    ret.append({
+                        'dir': dir,
+                        'subdir': subdir,
+                        'url': self._resolve_external_url(url, dir_url, repos_root),
+                        'peg-revision': peg_revision,
+                        'operative-revision': operative_revision,
+                    })
+        return ret
+
+    def _query_externals_ignore_failure(self, targets, revision):
+        try:
+            return self._query_externals(targets, revision)
+        except OsxSystemExecInterruptedError:
+            raise
+        except OsxSystemExecError:
+            if len(targets) == 1:
+                _logger.warning(u'svn: query externals of %s failed', _to_unicode_str(targets[0]))
+                return []
+        ret = []
+        for target in targets:  # find out the bad one
+            ret.extend(self._query_externals_ignore_failure([target], revision))
+        return ret
+
+    def get_externals(self, path='.', recursive=True, workers=4):
+        """
+        Discover svn:externals defined in path and it's sub directories.
+        Each level of externals is queried with one 'svn propget -R' per revision group, the groups run concurrently.
+        :param path: working copy path or remote url
+        :param recursive: also discover externals defined inside the externals, unreachable ones are skipped
+        :return: list of dict, e.g.
+            {'dir': directory holding the property, 'subdir': 'lib/foo', 'url': resolved absolute url,
+             'peg-revision': None or '10', 'operative-revision': None or '12'}
+        """
+        ret = self._query_externals([path], None)
+        level = ret
+        visited = set([(path, None)])
+        while recursive and level:
+            groups = {}  # (is_url, revision) -> targets
+            for external in level:
+                revision = external['operative-revision'] or external['peg-revision']
+                local_path = None if self.is_url(external['dir']) else os.path.join(external['dir'], external['subdir'])
+                if local_path is not None and os.path.isdir(local_path):
+                    target, revision = local_path, None  # checked out, use it's working copy
+                elif revision is not None:
+                    target = external['url'] + '@' + (external['peg-revision'] or revision)
+                else:
+                    target = external['url']
+                if (target, revision) in visited:
+                    continue
+                visited.add((target, revision))
+                groups.setdefault((self.is_url(target), revision), []).append(target)
+
+            jobs = []
+            for (is_url, revision), targets in groups.items():
+                for chunk in self.split_path_list(targets):
+                    jobs.append((chunk, revision))
+            level = []
+            for externals in _parallel_map(lambda job: self._query_externals_ignore_failure(job[0], job[1]), jobs, workers):
+                level.extend(externals)
+            ret.extend(level)
+        return ret
+
     def lock(self, file_path, msg):
         """
         :except:
@@ -697,6 +1844,109 @@ class Svn:
         cmd += ' ' + self.str_user_pass_option
         self.exec_sub_command(cmd)
 
+    def _info_entries(self, path_list, revision=None):
+        """
+        return list of info dict(see info_dict) of path_list, paths not exist are skipped
+        """
+        ret = []
+        for chunk in self.split_path_list(path_list):
+            cmd = 'info ' + self.stringing_path_list(chunk)
+            cmd += ' --xml'
+            cmd += ' ' + self.stringing_revision_option(revision)
+            for path in chunk:
+                if self.is_url(path):
+                    cmd += ' ' + self.str_user_pass_option
+                    break
+            # the warnings of paths not exist are kept out of the xml by reading OUTPUT only
+            try:
+                with self.exec_sub_command_output_stream(cmd) as stream:
+                    for event, node in ElementTree.iterparse(stream):
+                        if node.tag == 'entry':
+                            ret.append(self._parse_info_entry(node))
+            except OsxSystemExecInterruptedError:
+                raise
+            except (OsxSystemExecError, ElementTree.ParseError):
+                pass  # svn still exit with error after listing the existing paths, the xml is incomplete if none exist
+        return ret
+
+    def _lock_info_many(self, path_list):
+        """
+        return dict of path key -> lock dict(see info_dict) for the locked ones in path_list
+        """
+        ret = {}
+        for entry in self._info_entries(path_list, 'HEAD'):  # working copy only knows it's own locks
+            if 'lock' not in entry:
+                continue
+            ret[self._path_key(entry['#path'])] = entry['lock']
+            ret[self._path_key(entry['url'])] = entry['lock']
+        return ret
+
+    def _notified_path_keys(self, output, pattern):
+        return set(self._path_key(path) for path in pattern.findall(_to_unicode_str(output)))
+
+    def lock_many(self, file_path_list, msg):
+        """
+        Lock many files with as few svn commands as possible.
+        :param file_path_list: list/tuple of working copy paths or urls
+        :return: dict with
+            'locked': list of paths locked successfully
+            'failed': dict of path -> SvnAlreadyLockedError, or SvnError if the path is not locked by others
+        :except:
+            SvnNoMessageError: if msg is empty
+        """
+        if not msg:
+            raise SvnNoMessageError("lock on '%s'" % self.stringing_path_list(file_path_list))
+
+        locked_keys = set()
+        for chunk in self.split_path_list(file_path_list):
+            cmd = 'lock ' + self.stringing_path_list(chunk)
+            cmd += ' ' + self.stringing_message_option(msg)
+            cmd += ' ' + self.str_user_pass_option
+            output = self._exec_sub_command_output_ignore_failure(cmd, self._UNTRANSLATED_MESSAGES_ENV)
+            locked_keys |= self._notified_path_keys(output, self._NOTIFY_LOCKED_PATTERN)
+
+        ret = {'locked': [], 'failed': {}}
+        failed_path_list = []
+        for chunk in self.split_path_list(file_path_list):
+            for file_path in chunk:
+                if self._path_key(file_path) in locked_keys:
+                    ret['locked'].append(file_path)
+                else:
+                    failed_path_list.append(file_path)
+
+        if failed_path_list:
+            lock_infos = self._lock_info_many(failed_path_list)
+            for file_path in failed_path_list:
+                lock_info = lock_infos.get(self._path_key(file_path))
+                if lock_info is None:
+                    ret['failed'][file_path] = SvnError("svn: lock '%s' failed" % file_path)
+                else:
+                    ret['failed'][file_path] = SvnAlreadyLockedError(file_path, lock_info['owner'], lock_info['comment'], lock_info['created'])
+        return ret
+
+    def unlock_many(self, file_path_list, force=True):
+        """
+        Unlock many files with as few svn commands as possible.
+        :param file_path_list: list/tuple of working copy paths or urls
+        :return: dict with
+            'unlocked': list of paths unlocked successfully
+            'failed': list of paths failed to unlock
+        """
+        unlocked_keys = set()
+        for chunk in self.split_path_list(file_path_list):
+            cmd = 'unlock ' + self.stringing_path_list(chunk)
+            if force:
+                cmd += ' --force'
+            cmd += ' ' + self.str_user_pass_option
+            output = self._exec_sub_command_output_ignore_failure(cmd, self._UNTRANSLATED_MESSAGES_ENV)
+            unlocked_keys |= self._notified_path_keys(output, self._NOTIFY_UNLOCKED_PATTERN)
+
+        ret = {'unlocked': [], 'failed': []}
+        for chunk in self.split_path_list(file_path_list):
+            for file_path in chunk:
+                ret['unlocked' if self._path_key(file_path) in unlocked_keys else 'failed'].append(file_path)
+        return ret
+
     def move(self, src, dst, msg):
         """
         :except:
@@ -710,7 +1960,7 @@ class Svn:
         cmd += ' --force'
         cmd += ' --parents'
         cmd += ' ' + self.str_user_pass_option
-        self.exec_sub_command(cmd)
+        self._exec_mutating_sub_command(cmd)
 
     def branch(self, src, dst, msg, revision='HEAD'):
         """
@@ -720,18 +1970,15 @@ class Svn:
         if not msg:
             raise SvnNoMessageError("branch '%s' -> '%s'" % (src, dst))
 
-        try:
-            self.info_dict(dst)
+        if self.is_valid_svn_path(dst):
             raise SvnBranchDestinationAlreadyExistError(dst)
-        except OsxSystemExecError:
-            pass
 
         cmd = 'copy ' + src + ' ' + dst
         cmd += ' ' + self.stringing_revision_option(revision)
         cmd += ' ' + self.stringing_message_option(msg)
         cmd += ' --parents'
         cmd += ' ' + self.str_user_pass_option
-        self.exec_sub_command(cmd)
+        self._exec_mutating_sub_command(cmd)
 
     def rollback(self, revision_or_range, path='.'):
         """
@@ -772,11 +2019,199 @@ class Git:
     def set_redirect_output_to_log(self, redirect_output_to_log=True):
         self.osx.set_redirect_output_to_log(redirect_output_to_log)
 
-    def exec_sub_command(self, sub_command):
-        self.osx.exec_command(self.base_command + ' ' + sub_command)
+    def set_timeout(self, timeout):
+        self.osx.set_timeout(timeout)
+
+    def set_cancel_event(self, cancel_event):
+        self.osx.set_cancel_event(cancel_event)
+
+    def exec_sub_command(self, sub_command, timeout=None, cancel_event=None, cwd=None):
+        self.osx.exec_command(self.base_command + ' ' + sub_command, timeout, cancel_event, cwd)
+
+    def exec_sub_command_output(self, sub_command, timeout=None, cancel_event=None, cwd=None):
+        return self.osx.exec_command_output(self.base_command + ' ' + sub_command, timeout, cancel_event, cwd)
+
+    def exec_sub_command_output_stream(self, sub_command, timeout=None, cancel_event=None, cwd=None):
+        return self.osx.exec_command_output_stream(self.base_command + ' ' + sub_command, timeout, cancel_event, cwd)
+
+    _INDEX_ENTRY_FORMAT = struct.Struct('>10L20sH')
+    _INDEX_FLAG_ASSUME_VALID = 0x8000
+    _INDEX_FLAG_EXTENDED = 0x4000
+    _INDEX_FLAG_STAGE_MASK = 0x3000
+    _INDEX_FLAG_NAME_MASK = 0x0FFF
+    _INDEX_EXTENDED_FLAG_SKIP_WORKTREE = 0x4000
+    _INDEX_EXTENDED_FLAG_INTENT_TO_ADD = 0x2000
+    _MODE_GITLINK = 0o160000
+
+    def read_index(self, path='.'):
+        """
+        Parse the index file(version 2, 3, 4) of the working copy, split index is not supported.
+        return list of dict, e.g.
+            {'name': 'src/a.c', 'mode': 0o100644, 'size': 12, 'mtime': (seconds, nanoseconds), 'sha1': '...',
+             'stage': 0, 'assume-valid': False, 'skip-worktree': False, 'intent-to-add': False}
+        :except: GitParseMetaDataError
+        """
+        index_file_path = os.path.join(path, self.meta_data_base_dir, 'index')
+        try:
+            with open(index_file_path, 'rb') as fp:
+                data = fp.read()
+        except (IOError, OSError) as e:
+            raise GitParseMetaDataError("Can't read index file %s: %s" % (index_file_path, str(e)))
+
+        try:
+            signature, version, count = struct.unpack_from('>4sLL', data, 0)
+            if signature != b'DIRC' or version not in (2, 3, 4):
+                raise ValueError('unsupported signature %r or version %d' % (signature, version))
+
+            ret = []
+            offset = 12
+            previous_name = b''
+            for i in range(count):
+                (ctime_s, ctime_ns, mtime_s, mtime_ns, dev, ino, mode, uid, gid, size,
+                 sha1, flags) = self._INDEX_ENTRY_FORMAT.unpack_from(data, offset)
+                entry_offset = offset
+                offset += self._INDEX_ENTRY_FORMAT.size
+                extended_flags = 0
+                if version >= 3 and flags & self._INDEX_FLAG_EXTENDED:
+                    extended_flags = struct.unpack_from('>H', data, offset)[0]
+                    offset += 2
+
+                if version == 4:  # name is prefix compressed against the previous one
+                    byte = ord(data[offset:offset + 1])
+                    offset += 1
+                    strip_length = byte & 0x7F
+                    while byte & 0x80:
+                        byte = ord(data[offset:offset + 1])
+                        offset += 1
+                        strip_length = ((strip_length + 1) << 7) | (byte & 0x7F)
+                    end = data.index(b'\0', offset)
+                    name = previous_name[:len(previous_name) - strip_length] + data[offset:end]
+                    offset = end + 1
+                else:
+                    end = data.index(b'\0', offset)
+                    name = data[offset:end]
+                    offset = entry_offset + ((end - entry_offset + 8) // 8) * 8  # padded by 1~8 NUL
+                previous_name = name
+
+                ret.append({
+                    'name': name.decode('utf8'),
+                    'mode': mode,
+                    'size': size,
+                    'mtime': (mtime_s, mtime_ns),
+                    'sha1': binascii.hexlify(sha1).decode('ascii'),
+                    'stage': (flags & self._INDEX_FLAG_STAGE_MASK) >> 12,
+                    'assume-valid': bool(flags & self._INDEX_FLAG_ASSUME_VALID),
+                    'skip-worktree': bool(extended_flags & self._INDEX_EXTENDED_FLAG_SKIP_WORKTREE),
+                    'intent-to-add': bool(extended_flags & self._INDEX_EXTENDED_FLAG_INTENT_TO_ADD),
+                })
+
+            while offset + 8 <= len(data) - 20:  # extensions, followed by the checksum
+                extension_signature, extension_size = struct.unpack_from('>4sL', data, offset)
+                if extension_signature == b'link':  # core.splitIndex, the other entries are in the shared index
+                    raise ValueError('split index is not supported')
+                offset += 8 + extension_size
+        except Exception as e:
+            raise GitParseMetaDataError("Can't parse index file %s: %s" % (index_file_path, str(e)))
+        return ret
+
+    @classmethod
+    def _hash_blob(cls, content):
+        return hashlib.sha1(b'blob ' + str(len(content)).encode('ascii') + b'\0' + content).hexdigest()
+
+    @classmethod
+    def _is_content_modified(cls, file_path, entry):
+        try:
+            if entry['mode'] & 0o170000 == 0o120000:
+                content = os.readlink(file_path)
+                if not isinstance(content, bytes):
+                    content = content.encode('utf8')
+            else:
+                with open(file_path, 'rb') as fp:
+                    content = fp.read()
+        except (IOError, OSError):
+            return True
+        if cls._hash_blob(content) == entry['sha1']:
+            return False
+        # core.autocrlf converts CRLF to LF when the file is added
+        return b'\r\n' not in content or cls._hash_blob(content.replace(b'\r\n', b'\n')) != entry['sha1']
+
+    def _iter_modified_files(self, path, workers):
+        meta_data_dir = os.path.join(path, self.meta_data_base_dir)
+        if not os.path.isdir(meta_data_dir):  # also a file pointing to the real one in linked worktrees and submodules
+            raise GitParseMetaDataError("Can't find meta data directory %s" % meta_data_dir)
+        index_file_path = os.path.join(meta_data_dir, 'index')
+        try:
+            index_mtime_ns = _stat_mtime_ns(os.stat(index_file_path))
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return  # no index file, nothing tracked
+            raise GitParseMetaDataError("Can't read index file %s: %s" % (index_file_path, str(e)))
+        entries = self.read_index(path)
+
+        dir_names = sorted(set(posixpath.dirname(entry['name']) for entry in entries))
+        dir_stats = {}
+        for dir_name, entry_stats in _parallel_map(
+                lambda dir_name: (dir_name, _lstat_dir_entries(os.path.join(path, dir_name))), dir_names, workers):
+            dir_stats[dir_name] = entry_stats
+
+        reported_names = set()
+        suspected_entries = []
+        for entry in entries:
+            name = entry['name']
+            if entry['assume-valid'] or entry['skip-worktree'] or entry['mode'] == self._MODE_GITLINK:
+                continue
+            if entry['stage'] != 0 or entry['intent-to-add']:  # conflict or new file
+                if name not in reported_names:
+                    reported_names.add(name)
+                    yield name
+                continue
+
+            dir_name, base_name = posixpath.split(name)
+            st = dir_stats[dir_name].get(base_name)
+            if st is None or not (stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode)):
+                yield name
+                continue
+            if stat.S_IFMT(st.st_mode) != entry['mode'] & 0o170000:
+                yield name
+                continue
+            if not _IS_OS_WIN32 and stat.S_ISREG(st.st_mode) and \
+                    bool(st.st_mode & 0o100) != (entry['mode'] & 0o777 == 0o755):
+                yield name
+                continue
+            if st.st_size & 0xFFFFFFFF != entry['size']:
+                yield name
+                continue
+
+            mtime_ns = _stat_mtime_ns(st)
+            mtime_s, index_mtime_nsec = entry['mtime']
+            if mtime_ns // 1000000000 == mtime_s and (index_mtime_nsec == 0 or mtime_ns % 1000000000 == index_mtime_nsec) \
+                    and mtime_ns < index_mtime_ns:  # modified in the same time slice as the index is racy
+                continue
+            suspected_entries.append(entry)
+
+        for name, modified in _parallel_map(
+                lambda entry: (entry['name'], self._is_content_modified(os.path.join(path, entry['name']), entry)),
+                suspected_entries, workers):
+            if modified:
+                yield name
+
+    def modified_files(self, path='.', workers=8):
+        """
+        Compare the working copy with the index by the cached stat data, only hash files whose stat data changed.
+        Untracked files and changes staged into the index are not included.
+        return list of relative paths(separated by '/') of the modified files
+        :except: GitParseMetaDataError, also for linked worktrees and submodules whose meta data directory is elsewhere
+        """
+        return sorted(self._iter_modified_files(path, workers))
 
-    def exec_sub_command_output(self, sub_command):
-        return self.osx.exec_command_output(self.base_command + ' ' + sub_command)
+    def is_dirty(self, path='.', workers=8):
+        """
+        Whether any tracked file of the working copy is modified, see modified_files
+        :except: GitParseMetaDataError
+        """
+        for name in self._iter_modified_files(path, workers):
+            return True
+        return False
 
     def get_current_branch(self, path='.'):
         """
@@ -800,21 +2235,109 @@ class Git:
 
         return (branch_name, revision)
 
+    _LOG_RECORD_MARK = b'\x01'
+    _LOG_FORMAT = '%x01%H%x00%P%x00%an%x00%ae%x00%at%x00%cn%x00%ce%x00%ct%x00%B'
+
+    @classmethod
+    def _iter_nul_separated(cls, stream, chunk_size=65536):
+        rest = b''
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            fields = (rest + chunk).split(b'\0')
+            rest = fields.pop()
+            for field in fields:
+                yield field
+        if rest:
+            yield rest
+
+    def iter_log(self, path='.', rev_range='HEAD', paths=None, with_files=False):
+        """
+        Iterate the commit history incrementally, newest first.
+        :param rev_range: revision or range, e.g. 'HEAD', 'v1.0..master'
+        :param paths: None or list of paths to limit the history to
+        :param with_files: include the changed files of each commit
+        :return: generator of dict, e.g.
+            {'#revision': sha1, '#parents': [sha1, ...],
+             'author': ..., 'author-email': ..., 'author-date': timestamp,
+             'committer': ..., 'committer-email': ..., 'committer-date': timestamp,
+             'msg': ...,
+             'paths': [{'#': path, '#action': 'M'}, {'#': path, '#action': 'R', '#copyfrom-path': old_path}, ...]}
+            'paths' exists only if with_files is True
+        """
+        cmd = '-C ' + path
+        cmd += ' log -z --format=' + self._LOG_FORMAT
+        if with_files:
+            cmd += ' --name-status -M'
+        cmd += ' ' + rev_range
+        if paths:
+            cmd += ' -- ' + ' '.join(paths)
+
+        with self.exec_sub_command_output_stream(cmd) as stream:
+            fields = self._iter_nul_separated(stream)
+            logentry = None
+            for field in fields:
+                if field.startswith(self._LOG_RECORD_MARK):
+                    if logentry is not None:
+                        yield logentry
+                    header = [field[1:]] + [next(fields) for i in range(8)]
+                    header = [_to_unicode_str(value) for value in header]
+                    logentry = {}
+                    logentry['#revision'] = header[0]
+                    logentry['#parents'] = header[1].split()
+                    logentry['author'] = header[2]
+                    logentry['author-email'] = header[3]
+                    logentry['author-date'] = int(header[4])
+                    logentry['committer'] = header[5]
+                    logentry['committer-email'] = header[6]
+                    logentry['committer-date'] = int(header[7])
+                    logentry['msg'] = header[8].rstrip('\n')
+                    if with_files:
+                        logentry['paths'] = []
+                    continue
+
+                action = _to_unicode_str(field.lstrip(b'\n'))
+                if not action or logentry is None:
+                    continue
+                changed_path = {}
+                changed_path['#action'] = action[0]
+                if action[0] in ('R', 'C'):  # renamed or copied with similarity score
+                    changed_path['#copyfrom-path'] = _to_unicode_str(next(fields))
+                changed_path['#'] = _to_unicode_str(next(fields))
+                logentry['paths'].append(changed_path)
+            if logentry is not None:
+                yield logentry
+
     def clone(self, url, path):
         cmd = 'clone ' + url + ' ' + path
         self.exec_sub_command(cmd)
 
+    def _need_reset(self, path):
+        try:
+            if self.is_dirty(path):
+                return True
+        except GitParseMetaDataError:
+            return True
+        try:
+            self.exec_sub_command_output('diff --cached --quiet', cwd=path)  # changes staged into the index
+        except OsxSystemExecInterruptedError:
+            raise
+        except OsxSystemExecError:
+            return True
+        return False
+
     def get_clean(self, url, path, branch_name='master', revision=None):
         if not os.path.exists(path):
             self.clone(url, path)
 
-        with self.osx.ChangeDirectory(path):
-            self.exec_sub_command('reset --hard')  # revert local changes
-            self.exec_sub_command('fetch')
-            self.exec_sub_command('checkout ' + branch_name)
-            self.exec_sub_command('merge origin/' + branch_name)  # set current branch to newest
-            if revision is not None:
-                self.exec_sub_command('reset %s --hard' % revision)
+        if self._need_reset(path):
+            self.exec_sub_command('reset --hard', cwd=path)  # revert local changes
+        self.exec_sub_command('fetch', cwd=path)
+        self.exec_sub_command('checkout ' + branch_name, cwd=path)
+        self.exec_sub_command('merge origin/' + branch_name, cwd=path)  # set current branch to newest
+        if revision is not None:
+            self.exec_sub_command('reset %s --hard' % revision, cwd=path)
 
 # default Git object
 git = Git()
@@ -824,9 +2347,252 @@ class Zip:
     """
     A zip helper.
     """
+    class Index:
+        """
+        Random access reader of a zip file.
+        The central directory is parsed once and cached on disk(keyed by size and mtime of the zip file),
+        members are read directly by their offsets from the memory mapped file.
+        """
+        CACHE_VERSION = 1
+
+        # member fields
+        NAME, COMPRESS_TYPE, FLAG_BITS, CRC, COMPRESS_SIZE, FILE_SIZE, HEADER_OFFSET = range(7)
+
+        _END_OF_CENTRAL_DIR = struct.Struct('<4s4H2LH')
+        _END_OF_CENTRAL_DIR_SIGNATURE = b'PK\x05\x06'
+        _ZIP64_END_OF_CENTRAL_DIR_LOCATOR = struct.Struct('<4sLQL')
+        _ZIP64_END_OF_CENTRAL_DIR_LOCATOR_SIGNATURE = b'PK\x06\x07'
+        _ZIP64_END_OF_CENTRAL_DIR = struct.Struct('<4sQ2H2L4Q')
+        _ZIP64_END_OF_CENTRAL_DIR_SIGNATURE = b'PK\x06\x06'
+        _CENTRAL_DIR = struct.Struct('<4s4B4HL2L5H2L')
+        _CENTRAL_DIR_SIGNATURE = b'PK\x01\x02'
+        _LOCAL_FILE_HEADER = struct.Struct('<4s2B4HL2L2H')
+        _LOCAL_FILE_HEADER_SIGNATURE = b'PK\x03\x04'
+        _ZIP64_EXTRA_ID = 0x0001
+        _FLAG_ENCRYPTED = 0x1
+        _FLAG_UTF8 = 0x800
+
+        def __init__(self, zip_file_path, cache_dir=None):
+            """
+            :param cache_dir: where to cache the parsed central directory, None for the cache directory of the user, '' to disable
+            :except: ZipError
+            """
+            self.zip_file_path = zip_file_path
+            self._fp = open(zip_file_path, 'rb')
+            try:
+                st = os.fstat(self._fp.fileno())
+                if st.st_size == 0:
+                    raise ZipError("'%s' is not a zip file" % zip_file_path)
+                self._mmap = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+                self.members = self._load_members(st, cache_dir)
+            except:
+                self._fp.close()
+                raise
+            self._member_dict = dict((member[self.NAME], member) for member in self.members)
+            self._sorted_names = sorted(self._member_dict)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_value, exc_tb):
+            self.close()
+
+        def close(self):
+            self._mmap.close()
+            self._fp.close()
+
+        def _load_members(self, st, cache_dir):
+            if cache_dir == '':
+                return self._parse_central_dir()
+            if cache_dir is None:
+                cache_dir = _user_cache_dir()
+            abs_path = _to_unicode_str(os.path.abspath(self.zip_file_path))
+            cache_file_path = os.path.join(cache_dir, 'quickstartutil-zip-index-%s.marshal' %
+                                           hashlib.sha1(abs_path.encode('utf8')).hexdigest())
+            cache_key = (self.CACHE_VERSION, abs_path, st.st_size, _stat_mtime_ns(st))
+            # marshal loads plain data only, nothing in the file is run
+            cache = _load_cache_file(cache_file_path, marshal)
+            if self._is_valid_cache(cache, cache_key):
+                return cache[1]
+            members = self._parse_central_dir()
+            _save_cache_file(cache_file_path, (cache_key, members), marshal)
+            return members
+
+        @classmethod
+        def _is_valid_cache(cls, cache, cache_key):
+            if not isinstance(cache, tuple) or len(cache) != 2 or cache[0] != cache_key or not isinstance(cache[1], list):
+                return False
+            for member in cache[1]:
+                if not isinstance(member, tuple) or len(member) != cls.HEADER_OFFSET + 1 or not isinstance(member[cls.NAME], _unicode):
+                    return False
+                for value in member[cls.NAME + 1:]:
+                    if not isinstance(value, _integer_types) or value < 0:
+                        return False
+            return True
+
+        def _parse_central_dir(self):
+            data = self._mmap
+            end_pos = data.rfind(self._END_OF_CENTRAL_DIR_SIGNATURE, max(0, len(data) - 65536 - self._END_OF_CENTRAL_DIR.size))
+            if end_pos == -1:
+                raise ZipError("'%s' is not a zip file" % self.zip_file_path)
+            (_, _, _, _, count, central_dir_size, central_dir_offset, _) = self._END_OF_CENTRAL_DIR.unpack_from(data, end_pos)
+            central_dir_end = end_pos
+
+            locator_pos = end_pos - self._ZIP64_END_OF_CENTRAL_DIR_LOCATOR.size
+            if locator_pos >= 0 and data[locator_pos:locator_pos + 4] == self._ZIP64_END_OF_CENTRAL_DIR_LOCATOR_SIGNATURE:
+                zip64_end_pos = locator_pos - self._ZIP64_END_OF_CENTRAL_DIR.size
+                if data[zip64_end_pos:zip64_end_pos + 4] != self._ZIP64_END_OF_CENTRAL_DIR_SIGNATURE:
+                    raise ZipError("'%s' has corrupt zip64 end of central directory" % self.zip_file_path)
+                (_, _, _, _, _, _, _, count, central_dir_size, central_dir_offset) = \
+                    self._ZIP64_END_OF_CENTRAL_DIR.unpack_from(data, zip64_end_pos)
+                central_dir_end = zip64_end_pos
+
+            concat = central_dir_end - central_dir_size - central_dir_offset  # data prepended to the archive
+            pos = central_dir_end - central_dir_size
+            members = []
+            for i in range(count):
+                fields = self._CENTRAL_DIR.unpack_from(data, pos)
+                if fields[0] != self._CENTRAL_DIR_SIGNATURE:
+                    raise ZipError("'%s' has corrupt central directory" % self.zip_file_path)
+                flag_bits, compress_type, crc, compress_size, file_size = fields[5], fields[6], fields[9], fields[10], fields[11]
+                name_length, extra_length, comment_length, header_offset = fields[12], fields[13], fields[14], fields[18]
+                pos += self._CENTRAL_DIR.size
+                name = data[pos:pos + name_length]
+                name = name.decode('utf8') if flag_bits & self._FLAG_UTF8 else name.decode('cp437')
+                pos += name_length
+
+                extra_end = pos + extra_length
+                while pos + 4 <= extra_end:
+                    extra_id, extra_size = struct.unpack_from('<2H', data, pos)
+                    if extra_id == self._ZIP64_EXTRA_ID:
+                        values = list(struct.unpack_from('<%dQ' % (extra_size // 8), data, pos + 4))
+                        if file_size == 0xFFFFFFFF:
+                            file_size = values.pop(0)
+                        if compress_size == 0xFFFFFFFF:
+                            compress_size = values.pop(0)
+                        if header_offset == 0xFFFFFFFF:
+                            header_offset = values.pop(0)
+                    pos += 4 + extra_size
+                pos = extra_end + comment_length
+
+                members.append((name.replace('\\', '/'), compress_type, flag_bits, crc, compress_size, file_size,
+                                header_offset + concat))
+            return members
+
+        def names(self, pattern=None, prefix=None):
+            """
+            return the sorted member names
+            :param pattern: None or glob pattern the names must match
+            :param prefix: None or prefix the names must start with, e.g. 'bin/'
+            """
+            names = self._sorted_names
+            if prefix:
+                begin = bisect.bisect_left(names, prefix)
+                end = begin
+                while end < len(names) and names[end].startswith(prefix):
+                    end += 1
+                names = names[begin:end]
+            if pattern is not None:
+                names = fnmatch.filter(names, pattern)
+            return list(names)
+
+        def info(self, name):
+            """
+            return dict of 'name', 'compress-type', 'compress-size', 'file-size', 'crc'
+            :except: KeyError if name not exist
+            """
+            member = self._member_dict[name]
+            return {
+                'name': member[self.NAME],
+                'compress-type': member[self.COMPRESS_TYPE],
+                'compress-size': member[self.COMPRESS_SIZE],
+                'file-size': member[self.FILE_SIZE],
+                'crc': member[self.CRC],
+            }
+
+        def _iter_member_chunks(self, member, chunk_size=1048576):
+            data = self._mmap
+            header_offset = member[self.HEADER_OFFSET]
+            fields = self._LOCAL_FILE_HEADER.unpack_from(data, header_offset)
+            if fields[0] != self._LOCAL_FILE_HEADER_SIGNATURE:
+                raise ZipError("'%s' has corrupt local header of '%s'" % (self.zip_file_path, member[self.NAME]))
+            begin = header_offset + self._LOCAL_FILE_HEADER.size + fields[10] + fields[11]
+            end = begin + member[self.COMPRESS_SIZE]
+
+            compress_type = member[self.COMPRESS_TYPE]
+            if member[self.FLAG_BITS] & self._FLAG_ENCRYPTED or compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                # rare cases, leave them to zipfile
+                zf_obj = zipfile.ZipFile(self.zip_file_path)
+                try:
+                    yield zf_obj.read(member[self.NAME])
+                finally:
+                    zf_obj.close()
+                return
+
+            decompressor = zlib.decompressobj(-15) if compress_type == zipfile.ZIP_DEFLATED else None
+            crc = 0
+            for pos in range(begin, end, chunk_size):
+                chunk = data[pos:min(pos + chunk_size, end)]
+                if decompressor is not None:
+                    chunk = decompressor.decompress(chunk)
+                crc = zlib.crc32(chunk, crc)
+                yield chunk
+            if decompressor is not None:
+                chunk = decompressor.flush()
+                crc = zlib.crc32(chunk, crc)
+                yield chunk
+            if crc & 0xFFFFFFFF != member[self.CRC]:
+                raise ZipError("'%s' has bad CRC of '%s'" % (self.zip_file_path, member[self.NAME]))
+
+        def read(self, name):
+            """
+            return content of the member
+            :except: KeyError if name not exist, ZipError
+            """
+            return b''.join(self._iter_member_chunks(self._member_dict[name]))
+
+        def extract(self, names, to_dir):
+            """
+            extract the given members into directory, directories in archive are made
+            :param names: list of member names, e.g. index.names('bin/*.dll')
+            :return: list of extracted paths
+            :except: KeyError if any name not exist, ZipError
+            """
+            ret = []
+            for name in names:
+                member = self._member_dict[name]
+                # drop drive, absolute and parent components like zipfile does
+                arc_name = name.replace('/', os.sep)
+                if os.altsep:
+                    arc_name = arc_name.replace(os.altsep, os.sep)
+                parts = [os.path.splitdrive(part)[1] for part in os.path.splitdrive(arc_name)[1].split(os.sep)]
+                parts = [part for part in parts if part not in ('', os.curdir, os.pardir)]
+                target_path = os.path.join(to_dir, *parts) if parts else to_dir
+                if name.endswith('/'):
+                    if not os.path.isdir(target_path):
+                        os.makedirs(target_path)
+                    ret.append(target_path)
+                    continue
+                target_dir = os.path.dirname(target_path)
+                if not os.path.isdir(target_dir):
+                    os.makedirs(target_dir)
+                with open(target_path, 'wb') as fp:
+                    for chunk in self._iter_member_chunks(member):
+                        fp.write(chunk)
+                ret.append(target_path)
+            return ret
+
     def __init__(self):
         pass
 
+    def open_index(self, zip_file_path, cache_dir=None):
+        """
+        open a random access reader of .zip, see Zip.Index
+            with zip.open_index(path) as index:
+                index.extract(index.names('bin/*.dll'), to_dir)
+        """
+        return self.Index(zip_file_path, cache_dir)
+
     def _zip_file(self, file_path, zip_file_path):
         zf = zipfile.ZipFile(zip_file_path, "w", zipfile.zlib.DEFLATED)
         archive_name = os.path.basename(file_path)